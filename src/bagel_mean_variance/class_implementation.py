@@ -2,56 +2,168 @@
 A Class implementation of the functions in core.py
 """
 
+import numpy as np
 import pandas as pd
 from dataclasses import dataclass, field
-from .core import mvp_weights_using_returns, optimal_weights_using_returns
+from functools import cached_property
+from . import core
+from .core import MVContext, _blas, _optimal_weights_batch, build_context, mvp_weights_from_context, optimal_weights_from_context
 
+__all__ = [
+    "Portfolio",
+    "EqualWeightPortfolio",
+    "optimal_portfolio",
+    "optimal_portfolios",
+    "mvp_portfolio",
+]
 
-@dataclass(slots=True)
+
+def _to_fortran(returns: pd.DataFrame) -> np.ndarray:
+    """
+    Convert the returns to a column-major float64 array, the layout BLAS/LAPACK expect.
+    No copy is made when pandas already stores them that way.
+
+    :param returns (pd.DataFrame): The returns of the assets.
+    :return: The T*N returns in Fortran order.
+    """
+    return np.asfortranarray(returns.to_numpy(dtype=np.float64, copy=False))
+
+
+def _context_cholesky(context: MVContext) -> np.ndarray | None:
+    """
+    Get the Cholesky factor of the covariance matrix from a context.
+
+    :param context (MVContext): The cached context of the returns.
+    :return: L in the lower triangle, or None if the covariance matrix is singular.
+    """
+    return None if context.cho is None else context.cho[0]
+
+
+def _align_weights(weights: pd.Series | np.ndarray, assets: pd.Index) -> np.ndarray:
+    """
+    Convert the weights to a float64 array in the order of the assets.
+
+    A pd.Series is matched by label, any other array-like by position.
+
+    :param weights (pd.Series): The weights of the assets.
+    :param assets (pd.Index): The assets, i.e. the columns of the returns.
+    :return: The N weights in the order of the assets.
+    """
+    if not isinstance(weights, pd.Series):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (len(assets),):
+            raise ValueError(f"expected {len(assets)} weights, got shape {weights.shape}")
+        return weights
+    if not weights.index.equals(assets):
+        missing = assets.difference(weights.index)
+        extra = weights.index.difference(assets)
+        if len(missing) or len(extra):
+            raise ValueError(f"weights do not match the assets, missing: {list(missing)}, extra: {list(extra)}")
+        weights = weights.reindex(assets)
+    return weights.to_numpy(dtype=np.float64, copy=False)
+
+
+@dataclass
 class Portfolio:
     
     returns: pd.DataFrame
     weights: pd.Series
+    # Cholesky factor of the covariance (L in the lower triangle, the upper one is not used),
+    # only attached by optimal_portfolio, optimal_portfolios and mvp_portfolio
+    _cholesky: np.ndarray | None = field(default=None, init=False, repr=False, compare=False)
+    _R: np.ndarray = field(init=False, repr=False, compare=False)
+    _w: np.ndarray = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # work on plain arrays internally, pandas only at the boundary
+        self._R = _to_fortran(self.returns)
+        self._w = _align_weights(self.weights, self.returns.columns)
 
     @property
     def assets(self):
         return self.returns.columns
 
-    @property
+    @cached_property
+    def _has_nan(self) -> bool:
+        return bool(np.isnan(self._R).any())
+
+    @cached_property
+    def _mu(self) -> np.ndarray:
+        if self._has_nan:
+            # keep pandas' NaN-skipping semantics, e.g. the first pct_change row
+            return self.returns.mean().to_numpy(dtype=np.float64)
+        return core._mu(self._R)
+
+    @cached_property
+    def _cov(self) -> np.ndarray:
+        if self._has_nan:
+            return self.returns.cov().to_numpy(dtype=np.float64)
+        return core._cov(self._R)
+
+    @cached_property
     def mean_returns(self):
-        return self.returns.mean()
+        return pd.Series(self._mu, index=self.assets, copy=False)
 
-    @property
+    @cached_property
     def covariance_matrix(self):
-        return self.returns.cov()
+        return pd.DataFrame(self._cov, index=self.assets, columns=self.assets, copy=False)
 
-    @property
+    @cached_property
     def expected_return(self):
-        return self.mean_returns @ self.weights
+        return np.float64(self._mu @ self._w)
 
-    @property
+    @cached_property
     def variance(self):
-        return self.weights.T @ self.covariance_matrix @ self.weights
-
-    @property
+        if self._cholesky is not None:
+            # cov = L * L^T, so w^T * cov * w = ||L^T * w||^2, one triangular matvec
+            dtype = np.result_type(self._cholesky, self._w)
+            y = _blas("trmv", dtype)(self._cholesky, self._w, lower=1, trans=1)
+            return np.float64(_blas("dot", dtype)(y, y))
+        # w^T * cov * w, symmetric matvec (half the flops of a gemv) then a dot
+        # np.float64, not float: a rounding-negative variance gives a nan volatility, not a complex one
+        dtype = np.result_type(self._cov, self._w)
+        cov_w = _blas("symv", dtype)(1.0, self._cov, self._w, lower=0)
+        return np.float64(_blas("dot", dtype)(self._w, cov_w))
+
+    @cached_property
     def volatility(self):
         return self.variance ** 0.5
 
-    @property
-    def sharpe_ratio(self, rf: float = 0.0):
+    def sharpe_ratio(self, rf: float = 0.0) -> float:
         return (self.expected_return - rf) / self.volatility
 
-    @property
+    @cached_property
     def accumulated_returns_asset(self):
-        return (self.returns + 1).cumprod() - 1
+        if self._has_nan:
+            return (self.returns + 1).cumprod() - 1
+        # one T*N buffer, updated in place: (returns + 1).cumprod() - 1
+        acc = np.add(self._R, 1.0)
+        np.cumprod(acc, axis=0, out=acc)
+        acc -= 1.0
+        return pd.DataFrame(acc, index=self.returns.index, columns=self.assets)
 
     @property
     def accumulated_returns_portfolio(self):
         return (self.accumulated_returns_asset + 1) @ self.weights - 1
 
+    @classmethod
+    def batch_metrics(cls, returns: np.ndarray, weights: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate the expected return and variance of K portfolios at once.
+
+        :param returns (np.ndarray): The T*N returns of the assets.
+        :param weights (np.ndarray): The K*N weights, one portfolio per row.
+        :return: The K expected returns and the K variances.
+        """
+        mu = core._mu(returns)
+        cov = core._cov(returns)
+        expected_returns = weights @ mu
+        variances = np.einsum("ki,ij,kj->k", weights, cov, weights, optimize=True)
+        return expected_returns, variances
 
 
-@dataclass(slots=True)
+
+@dataclass
 class EqualWeightPortfolio(Portfolio):
 
     returns: pd.DataFrame
@@ -59,30 +171,70 @@ class EqualWeightPortfolio(Portfolio):
 
     def __post_init__(self):
         self.weights = pd.Series(1 / len(self.returns.columns), index=self.returns.columns)
+        super().__post_init__()
 
 
 
-def optimal_portfolio(returns: pd.DataFrame, target_return: float) -> Portfolio:
+def optimal_portfolio(returns: pd.DataFrame,
+                      target_return: float,
+                      context: MVContext | None = None) -> Portfolio:
     """
     Calculate the optimal portfolio for a given target return.
+
+    Pass a context from build_context(returns.values) to reuse it across
+    many target returns, e.g. when sweeping the efficient frontier.
     
     :param returns (np.ndarray): The returns of the assets.
     :param target_return (float): The target return.
+    :param context (MVContext | None): The cached context of the returns.
     :return: The optimal portfolio.
     """
-    weights = optimal_weights_using_returns(target_return, returns.values)
-    weights = pd.Series(weights, index=returns.columns)
-    return Portfolio(returns, weights)
-
+    if context is None:
+        context = build_context(_to_fortran(returns))
+    weights = optimal_weights_from_context(context, target_return).astype(np.float64, copy=False)
+    weights = pd.Series(weights, index=returns.columns, copy=False)
+    portfolio = Portfolio(returns, weights)
+    portfolio._cholesky = _context_cholesky(context)
+    return portfolio
+
+
+def optimal_portfolios(returns: pd.DataFrame,
+                       target_returns: np.ndarray,
+                       context: MVContext | None = None) -> list[Portfolio]:
+    """
+    Calculate the optimal portfolios for many target returns, e.g. the efficient frontier.
 
-def mvp_portfolio(returns: pd.DataFrame) -> Portfolio:
+    :param returns (np.ndarray): The returns of the assets.
+    :param target_returns (np.ndarray): The target returns.
+    :param context (MVContext | None): The cached context of the returns.
+    :return: The optimal portfolios, one per target return.
+    """
+    if context is None:
+        context = build_context(_to_fortran(returns))
+    # the K rows are views of one K*N array, and all Series share one Index
+    weights = _optimal_weights_batch(target_returns, context.g, context.h).astype(np.float64, copy=False)
+    assets = returns.columns
+    cholesky = _context_cholesky(context)
+    portfolios = [Portfolio(returns, pd.Series(w, index=assets, copy=False)) for w in weights]
+    for portfolio in portfolios:
+        portfolio._cholesky = cholesky
+    return portfolios
+
+
+def mvp_portfolio(returns: pd.DataFrame,
+                  context: MVContext | None = None) -> Portfolio:
     """
     Calculate the minimum variance portfolio.
     
     :param returns (np.ndarray): The returns of the assets.
+    :param context (MVContext | None): The cached context of the returns.
     :return: The minimum variance portfolio.
     """
-    weights = mvp_weights_using_returns(returns.values)
-    weights = pd.Series(weights, index=returns.columns)
-    return Portfolio(returns, weights)
+    if context is None:
+        context = build_context(_to_fortran(returns))
+    weights = mvp_weights_from_context(context).astype(np.float64, copy=False)
+    weights = pd.Series(weights, index=returns.columns, copy=False)
+    portfolio = Portfolio(returns, weights)
+    portfolio._cholesky = _context_cholesky(context)
+    return portfolio
 
@@ -4,13 +4,75 @@ The core module to handle the calculation of the mean-variance optimization.
 Outside use:
 
     - optimal_weights(target_return: float, mu: np.ndarray, cov: np.ndarray) -> np.ndarray
-    - optimal_weights_using_returns(target_return: float, returns: np.ndarray) -> np.ndarray
+    - optimal_weights_using_returns(target_return: float, returns: np.ndarray, dtype=np.float64) -> np.ndarray
+    - optimal_weights_batch(target_returns: np.ndarray, mu: np.ndarray, cov: np.ndarray) -> np.ndarray
     - mvp_weights(cov_matrix: np.ndarray) -> np.ndarray
-    - mvp_weights_using_returns(returns: np.ndarray) -> np.ndarray
+    - mvp_weights_using_returns(returns: np.ndarray, dtype=np.float64) -> np.ndarray
+    - build_context(returns: np.ndarray, dtype=np.float64) -> MVContext
+    - optimal_weights_from_context(context: MVContext, target_return: float) -> np.ndarray
+    - mvp_weights_from_context(context: MVContext) -> np.ndarray
 """
 
 
 import numpy as np
+from dataclasses import dataclass
+from functools import lru_cache
+from scipy.linalg import get_blas_funcs, get_lapack_funcs
+
+__all__ = [
+    "optimal_weights",
+    "optimal_weights_using_returns",
+    "optimal_weights_batch",
+    "mvp_weights",
+    "mvp_weights_using_returns",
+    "MVContext",
+    "build_context",
+    "optimal_weights_from_context",
+    "mvp_weights_from_context",
+]
+
+
+@lru_cache(maxsize=None)
+def _blas(name: str, dtype: np.dtype):
+    """
+    Get the BLAS routine specialized for the dtype, e.g. ("syrk", float32) -> ssyrk.
+
+    The lookup is resolved once per (name, dtype) and cached.
+
+    :param name (str): The routine name without the type prefix.
+    :param dtype (np.dtype): The dtype of the operands.
+    :return: The BLAS routine.
+    """
+    return get_blas_funcs(name, dtype=dtype)
+
+
+@lru_cache(maxsize=None)
+def _lapack(name: str, dtype: np.dtype):
+    """
+    Get the LAPACK routine specialized for the dtype, e.g. ("potrf", float64) -> dpotrf.
+
+    The lookup is resolved once per (name, dtype) and cached.
+
+    :param name (str): The routine name without the type prefix.
+    :param dtype (np.dtype): The dtype of the operands.
+    :return: The LAPACK routine.
+    """
+    return get_lapack_funcs(name, dtype=dtype)
+
+
+def _as_float_array(x) -> np.ndarray:
+    """
+    Convert array-likes (lists, pd.Series, pd.DataFrame) to a float ndarray.
+
+    float32 is kept, anything else becomes float64. No copy for ndarrays that already qualify.
+
+    :param x: The array-like.
+    :return: The ndarray.
+    """
+    x = np.asarray(x)
+    if x.dtype != np.float32:
+        x = x.astype(np.float64, copy=False)
+    return x
 
 
 def _mu(returns: np.ndarray) -> np.ndarray:
@@ -18,42 +80,132 @@ def _mu(returns: np.ndarray) -> np.ndarray:
 
 
 def _cov(returns: np.ndarray) -> np.ndarray:
-    return np.cov(returns, rowvar=False)
+    """
+    Calculate the sample covariance matrix (ddof=1) of the returns.
 
+    The centered returns are pre-scaled by 1/sqrt(T-1) so a single BLAS syrk
+    call computes only the upper triangle of X^T * X, which is then mirrored.
+    X is written in Fortran order so syrk does not copy it again.
+    float32 returns stay float32 (ssyrk), anything else is computed in float64.
 
-def _cov_inv(cov_matrix: np.ndarray) -> np.ndarray:
-    return np.linalg.inv(cov_matrix)
+    :param returns (np.ndarray): The T*N returns of the assets.
+    :return: The N*N covariance matrix.
+    """
+    X = np.subtract(returns, returns.mean(axis=0), order="F")
+    X *= 1.0 / np.sqrt(returns.shape[0] - 1)
+    syrk = _blas("syrk", X.dtype)
+    cov = syrk(1.0, X, trans=1)
+    i_lower = np.tril_indices_from(cov, -1)
+    cov[i_lower] = cov.T[i_lower]
+    return cov
 
 
-def _A(mu: np.ndarray, cov_inv: np.ndarray) -> float:
+def _is_singular(c: np.ndarray) -> bool:
     """
-    Calculate the A = mu^T * cov_inv * ones.
+    Check a Cholesky factor for numerical singularity.
 
-    :param mu (np.ndarray): The mean of the returns.
-    :param cov_inv (np.ndarray): The inverse of the covariance matrix.
-    :return: The A value.
+    cond(cov) >= (max pivot / min pivot)^2, so a pivot ratio below sqrt(N * eps)
+    means the covariance matrix is singular to working precision.
+
+    :param c (np.ndarray): The Cholesky factor, L on its diagonal.
+    :return: True if cov should be treated as singular.
     """
-    return np.dot(mu, cov_inv @ np.ones(mu.shape[0]))
+    pivots = np.abs(np.diagonal(c))
+    return pivots.min() <= pivots.max() * np.sqrt(c.shape[0] * np.finfo(c.dtype).eps)
 
 
-def _B(mu: np.ndarray, cov_inv: np.ndarray) -> float:
+def _cho_factor(cov: np.ndarray) -> tuple[np.ndarray, bool] | None:
     """
-    Calculate the B = mu^T * cov_inv * mu.
+    Calculate the Cholesky factorization of the covariance matrix.
+
+    Calls LAPACK potrf directly (spotrf/dpotrf by dtype), skipping the argument
+    validation of scipy.linalg.cho_factor, which dominates the runtime for small N.
 
-    :param cov_inv (np.ndarray): The inverse of the covariance matrix.
-    :return: The B value.
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :return: The (c, lower) factor, c holds L in its lower triangle,
+             or None if cov is not (numerically) positive definite.
     """
-    return np.dot(mu, cov_inv @ mu)
+    potrf = _lapack("potrf", cov.dtype)
+    c, info = potrf(cov, lower=1, clean=0, overwrite_a=0)
+    if info < 0:
+        raise ValueError(f"illegal value in {-info}-th argument of potrf")
+    if info > 0 or _is_singular(c):
+        return None
+    return c, True
+
 
+def _cho_solve(cho: tuple[np.ndarray, bool], rhs: np.ndarray) -> np.ndarray:
+    """
+    Solve cov * x = rhs given the Cholesky factor of cov, via LAPACK potrs.
 
-def _C(cov_inv: np.ndarray) -> float:
+    :param cho (tuple[np.ndarray, bool]): The Cholesky factor from _cho_factor.
+    :param rhs (np.ndarray): The right hand side, a N vector or N*K matrix.
+    :return: The solution x = cov_inv * rhs.
     """
-    Calculate the C = ones^T * cov_inv * ones.
+    c, lower = cho
+    potrs = _lapack("potrs", c.dtype)
+    x, info = potrs(c, rhs, lower=lower)
+    if info < 0:
+        raise ValueError(f"illegal value in {-info}-th argument of potrs")
+    return x
 
-    :param cov_inv (np.ndarray): The inverse of the covariance matrix.
-    :return: The C value.
+
+def _pinv_solve(cov: np.ndarray, rhs: np.ndarray) -> np.ndarray:
     """
-    return np.dot(np.ones(cov_inv.shape[0]), cov_inv @ np.ones(cov_inv.shape[0]))
+    Solve cov * x = rhs in the least squares sense, via the SVD pseudo-inverse of cov.
+
+    The fallback for singular or near-singular (e.g. detoned) covariance matrices,
+    singular values below N * eps * s_max are treated as zero.
+
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :param rhs (np.ndarray): The right hand side, a N vector or N*K matrix.
+    :return: The minimum norm solution x = pinv(cov) * rhs.
+    """
+    U, s, Vt = np.linalg.svd(cov, full_matrices=False, hermitian=True)
+    cutoff = s.max(initial=0.0) * cov.shape[0] * np.finfo(s.dtype).eps
+    s_inv = np.divide(1.0, s, out=np.zeros_like(s), where=s > cutoff)
+    Ut_rhs = U.T @ rhs
+    Ut_rhs *= s_inv if rhs.ndim == 1 else s_inv[:, None]
+    return Vt.T @ Ut_rhs
+
+
+def _solve_spd(cov: np.ndarray,
+               rhs: np.ndarray,
+               cho: tuple[np.ndarray, bool] | None) -> np.ndarray:
+    """
+    Solve cov * x = rhs given the result of _cho_factor(cov).
+
+    Uses the Cholesky factor when cov is positive definite, the pseudo-inverse
+    otherwise, so callers do not need to handle the singular case.
+
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :param rhs (np.ndarray): The right hand side, a N vector or N*K matrix.
+    :param cho (tuple[np.ndarray, bool] | None): The Cholesky factor of cov, or None.
+    :return: The solution x = cov_inv * rhs.
+    """
+    if cho is None:
+        return _pinv_solve(cov, rhs)
+    return _cho_solve(cho, rhs)
+
+
+def _solve_cov(cov: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    """
+    Solve cov * x = rhs in one LAPACK posv call, for when the factor is not reused.
+
+    Falls back to the pseudo-inverse if cov is not (numerically) positive definite.
+    cov is left untouched.
+
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :param rhs (np.ndarray): The right hand side, a N vector or N*K matrix.
+    :return: The solution x = cov_inv * rhs.
+    """
+    posv = _lapack("posv", cov.dtype)
+    c, x, info = posv(cov, rhs, lower=1, overwrite_a=0, overwrite_b=0)
+    if info < 0:
+        raise ValueError(f"illegal value in {-info}-th argument of posv")
+    if info > 0 or _is_singular(c):
+        return _pinv_solve(cov, rhs)
+    return x
 
 
 def _D(A: float, B: float, C: float) -> float:
@@ -68,42 +220,35 @@ def _D(A: float, B: float, C: float) -> float:
     return B * C - A**2
 
 
-def _g(A: float, 
-       B: float, 
-       D: float,
-       mu: np.ndarray,
-       cov_inv: np.ndarray) -> np.ndarray:
+def _gh(mu: np.ndarray,
+        cov: np.ndarray,
+        cho: tuple[np.ndarray, bool] | None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Calculate the g (N*1) = 1/d * (B * cov_inv * ones - A * cov_inv * mu).
-
-    :param A (float): The A value = mu^T * cov_inv * ones
-    :param B (float): The B value = mu^T * cov_inv * mu
-    :param C (float): The C value = ones^T * cov_inv * ones
-    :param D (float): The D value = A * C - B^2
-    :param mu (np.ndarray): The mean of the returns.
-    :param cov_inv (np.ndarray): The inverse of the covariance matrix.
-    :return: The g value.
-    """
-    return (B * cov_inv @ np.ones(mu.shape[0]) - A * cov_inv @ mu) / D
+    Calculate the g and h (N*1) vectors of the efficient frontier.
 
+    Solves cov * Z = [ones, mu] once, so Z[:, 0] = cov_inv * ones and
+    Z[:, 1] = cov_inv * mu, then:
 
-def _h(A: float, 
-       C: float, 
-       D: float,
-       mu: np.ndarray,
-       cov_inv: np.ndarray) -> np.ndarray:
-    """
-    Calculate the h (N*1) = 1/d * (C * cov_inv * mu - A * cov_inv * ones).
+        g = 1/D * (B * cov_inv * ones - A * cov_inv * mu)
+        h = 1/D * (C * cov_inv * mu - A * cov_inv * ones)
 
-    :param A (float): The A value = mu^T * cov_inv * ones
-    :param B (float): The B value = mu^T * cov_inv * mu
-    :param C (float): The C value = ones^T * cov_inv * ones
-    :param D (float): The D value = A * C - B^2
     :param mu (np.ndarray): The mean of the returns.
-    :param cov_inv (np.ndarray): The inverse of the covariance matrix.
-    :return: The h value.
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :param cho (tuple[np.ndarray, bool] | None): The Cholesky factor of cov, or None.
+    :return: The g and h vectors, and cov_inv * ones (the unnormalized mvp weights).
     """
-    return (C * cov_inv @ mu - A * cov_inv @ np.ones(mu.shape[0])) / D
+    rhs = np.empty((mu.shape[0], 2), dtype=mu.dtype)
+    rhs[:, 0] = 1.0
+    rhs[:, 1] = mu
+    Z = _solve_spd(cov, rhs, cho)
+    cov_inv_ones, cov_inv_mu = Z[:, 0], Z[:, 1]
+    A = mu @ cov_inv_ones
+    B = mu @ cov_inv_mu
+    C = cov_inv_ones.sum()
+    D = _D(A, B, C)
+    g = (B * cov_inv_ones - A * cov_inv_mu) / D
+    h = (C * cov_inv_mu - A * cov_inv_ones) / D
+    return g, h, cov_inv_ones
 
 
 def _optimal_weights(target_return: float,
@@ -132,18 +277,47 @@ def optimal_weights(target_return: float,
     :param cov (np.ndarray): The covariance matrix of the returns.
     :return: The weight of the assets.
     """
-    cov_inv = _cov_inv(cov)
-    A = _A(mu, cov_inv)
-    B = _B(mu, cov_inv)
-    C = _C(cov_inv)
-    D = _D(A, B, C)
-    g = _g(A, B, D, mu, cov_inv)
-    h = _h(A, C, D, mu, cov_inv)
+    mu, cov = _as_float_array(mu), _as_float_array(cov)
+    g, h, _ = _gh(mu, cov, _cho_factor(cov))
     return _optimal_weights(target_return, g, h)
 
 
+def _optimal_weights_batch(target_returns: np.ndarray,
+                           g: np.ndarray,
+                           h: np.ndarray) -> np.ndarray:
+    """
+    Calculate the weight of the assets for K target returns at once.
+
+    The weight is a K*N matrix, row k is g + h * target_returns[k].
+    :param target_returns (np.ndarray): The K target returns.
+    :param g (np.ndarray): The g value.
+    :param h (np.ndarray): The h value.
+    :return: The weight of the assets.
+    """
+    return g[None, :] + np.asarray(target_returns, dtype=np.float64)[:, None] * h[None, :]
+
+
+def optimal_weights_batch(target_returns: np.ndarray,
+                          mu: np.ndarray,
+                          cov: np.ndarray) -> np.ndarray:
+    """
+    Calculate the weight of the assets for many target returns, e.g. the efficient frontier.
+
+    The covariance matrix is factorized once for all target returns.
+    The weight is a K*N matrix, one row per target return.
+    :param target_returns (np.ndarray): The K target returns.
+    :param mu (np.ndarray): The mean of the returns.
+    :param cov (np.ndarray): The covariance matrix of the returns.
+    :return: The weight of the assets.
+    """
+    mu, cov = _as_float_array(mu), _as_float_array(cov)
+    g, h, _ = _gh(mu, cov, _cho_factor(cov))
+    return _optimal_weights_batch(target_returns, g, h)
+
+
 def optimal_weights_using_returns(target_return: float,
-                                  returns: np.ndarray) -> np.ndarray:
+                                  returns: np.ndarray,
+                                  dtype: type = np.float64) -> np.ndarray:
     """
     Calculate the weight of the assets for the minimum variance portfolio.
 
@@ -151,11 +325,12 @@ def optimal_weights_using_returns(target_return: float,
     The weight is a N*1 vector.
     :param target_return (float): The target return.
     :param returns (np.ndarray): The returns of the assets.
-    :return: The weight of the assets.
+    :param dtype (type): The precision of the computation, see build_context.
+    :return: The weight of the assets, always float64.
     """
-    mu = _mu(returns)
-    cov = _cov(returns)
-    return optimal_weights(target_return, mu, cov)
+    returns = np.asarray(returns, dtype=dtype, order="F")
+    weights = optimal_weights(target_return, _mu(returns), _cov(returns))
+    return weights.astype(np.float64, copy=False)
 
 
 def mvp_weights(cov_matrix: np.ndarray) -> np.ndarray:
@@ -166,19 +341,93 @@ def mvp_weights(cov_matrix: np.ndarray) -> np.ndarray:
     :param cov_matrix (np.ndarray): The covariance matrix of the returns.
     :return: The weight of the assets.
     """
-    cov_inv = _cov_inv(cov_matrix)
-    C = _C(cov_inv)
-    return cov_inv @ np.ones(cov_inv.shape[0]) / C
+    cov_matrix = _as_float_array(cov_matrix)
+    cov_inv_ones = _solve_cov(cov_matrix, np.ones(cov_matrix.shape[0], dtype=cov_matrix.dtype))
+    return cov_inv_ones / cov_inv_ones.sum()
 
 
-def mvp_weights_using_returns(returns: np.ndarray) -> np.ndarray:
+def mvp_weights_using_returns(returns: np.ndarray,
+                              dtype: type = np.float64) -> np.ndarray:
     """
     Calculate the weight of the assets for the minimum variance portfolio.
     The weight is calculated by the formula: w = cov_inv * ones / (ones^T * cov_inv * ones)
     The weight is a N*1 vector.
     :param returns (np.ndarray): The returns of the assets.
-    :return: The weight of the assets.
+    :param dtype (type): The precision of the computation, see build_context.
+    :return: The weight of the assets, always float64.
+    """
+    returns = np.asarray(returns, dtype=dtype, order="F")
+    return mvp_weights(_cov(returns)).astype(np.float64, copy=False)
+
+
+
+
+@dataclass(frozen=True, slots=True)
+class MVContext:
+    """
+    The quantities of the mean-variance problem that only depend on the returns.
+
+    Build it once with build_context and reuse it for every target return,
+    only g + h * target_return is left to compute per call.
+    The arrays are read-only, so a context can be shared by every portfolio built from it.
+    """
+
+    mu: np.ndarray
+    cov: np.ndarray
+    cho: tuple[np.ndarray, bool] | None
+    g: np.ndarray
+    h: np.ndarray
+    mvp: np.ndarray
+
+
+def build_context(returns: np.ndarray, dtype: type = np.float64) -> MVContext:
+    """
+    Calculate mu, cov, its Cholesky factor, g, h and the mvp weights for the returns.
+
+    Keep the context and pass it explicitly to reuse the factorization, e.g.
+    across target returns. The arrays of the context are read-only.
+
+    With dtype=np.float32 the returns are cast to single precision and the
+    whole computation runs on ssyrk/spotrf/spotrs: half the memory traffic and
+    twice the SIMD width for large N, at the cost of precision. Use it for
+    screening and approximation only.
+
+    :param returns (np.ndarray): The returns of the assets.
+    :param dtype (type): np.float64 (default) or np.float32.
+    :return: The context to pass to optimal_weights_from_context.
     """
+    returns = np.asarray(returns, dtype=dtype, order="F")
+    mu = _mu(returns)
     cov = _cov(returns)
-    return mvp_weights(cov)
+    cho = _cho_factor(cov)
+    g, h, cov_inv_ones = _gh(mu, cov, cho)
+    mvp = cov_inv_ones / cov_inv_ones.sum()
+    context = MVContext(mu, cov, cho, g, h, mvp)
+    # shared by every caller holding the context
+    for array in (mu, cov, g, h, mvp, *(() if cho is None else cho[:1])):
+        array.flags.writeable = False
+    return context
+
+
+def optimal_weights_from_context(context: MVContext,
+                                 target_return: float) -> np.ndarray:
+    """
+    Calculate the weight of the assets for a target return from a cached context.
+
+    The weight is a N*1 vector.
+    :param context (MVContext): The context built by build_context.
+    :param target_return (float): The target return.
+    :return: The weight of the assets.
+    """
+    return _optimal_weights(target_return, context.g, context.h)
 
+
+def mvp_weights_from_context(context: MVContext) -> np.ndarray:
+    """
+    Calculate the weight of the assets for the minimum variance portfolio from a cached context.
+
+    The weight is a N*1 vector.
+    :param context (MVContext): The context built by build_context.
+    :return: The weight of the assets.
+    """
+    return context.mvp.copy()
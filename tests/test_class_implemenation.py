@@ -7,7 +7,7 @@ import unittest
 import pandas as pd
 import numpy as np
 
-from src.bagel_mean_variance import EqualWeightPortfolio, optimal_portfolio, mvp_portfolio
+from src.bagel_mean_variance import Portfolio, EqualWeightPortfolio, optimal_portfolio, optimal_portfolios, mvp_portfolio, build_context
 
 
 class TestPortfolio(unittest.TestCase):
@@ -35,6 +35,65 @@ class TestPortfolio(unittest.TestCase):
         print("EqualWeightPortfolio Expected Return:", eqw_portfolio.expected_return)
         print("EqualWeightPortfolio Variance:", eqw_portfolio.variance)
 
+    def test_portfolio_matches_pandas(self):
+        eqw_portfolio = EqualWeightPortfolio(self.returns)
+        weights = eqw_portfolio.weights
+
+        pd.testing.assert_series_equal(eqw_portfolio.mean_returns, self.returns.mean())
+        pd.testing.assert_frame_equal(eqw_portfolio.covariance_matrix, self.returns.cov())
+        self.assertAlmostEqual(eqw_portfolio.expected_return, self.returns.mean() @ weights)
+        self.assertAlmostEqual(eqw_portfolio.variance, weights @ self.returns.cov() @ weights)
+        self.assertAlmostEqual(eqw_portfolio.sharpe_ratio(),
+                               eqw_portfolio.expected_return / eqw_portfolio.volatility)
+        self.assertAlmostEqual(eqw_portfolio.sharpe_ratio(rf=0.01),
+                               (eqw_portfolio.expected_return - 0.01) / eqw_portfolio.volatility)
+        pd.testing.assert_frame_equal(eqw_portfolio.accumulated_returns_asset,
+                                      (self.returns + 1).cumprod() - 1)
+
+        # statistics are computed once per portfolio
+        self.assertIs(eqw_portfolio.covariance_matrix, eqw_portfolio.covariance_matrix)
+        self.assertIs(eqw_portfolio.accumulated_returns_asset, eqw_portfolio.accumulated_returns_asset)
+
+    def test_permuted_weights(self):
+        weights = pd.Series([0.5, 0.3, 0.2], index=self.returns.columns)
+        portfolio = Portfolio(self.returns, weights)
+        permuted = Portfolio(self.returns, weights[['Asset3', 'Asset1', 'Asset2']])
+        self.assertAlmostEqual(permuted.expected_return, portfolio.expected_return)
+        self.assertAlmostEqual(permuted.variance, portfolio.variance)
+        self.assertAlmostEqual(permuted.expected_return, self.returns.mean() @ weights)
+
+        with self.assertRaises(ValueError):
+            Portfolio(self.returns, weights[['Asset1', 'Asset2']])
+
+        # plain arrays are matched by position
+        array_portfolio = Portfolio(self.returns, weights.to_numpy())  # type: ignore
+        self.assertAlmostEqual(array_portfolio.expected_return, portfolio.expected_return)
+        self.assertAlmostEqual(array_portfolio.variance, portfolio.variance)
+        with self.assertRaises(ValueError):
+            Portfolio(self.returns, np.array([0.5, 0.5]))  # type: ignore
+
+        # the Cholesky factor is internal, not a constructor argument
+        with self.assertRaises(TypeError):
+            Portfolio(self.returns, weights, np.eye(3))  # type: ignore
+
+    def test_degenerate_variance(self):
+        rng = np.random.default_rng(0)
+        returns = pd.DataFrame(rng.normal(size=(50, 3)), columns=['x', 'y', 'z'])
+        returns['w'] = -returns.sum(axis=1)
+        portfolio = EqualWeightPortfolio(returns)
+        self.assertAlmostEqual(portfolio.variance, 0.0)
+        with np.errstate(invalid='ignore'):  # the variance may round to a tiny negative number
+            self.assertNotIsInstance(portfolio.volatility, complex)
+            self.assertNotIsInstance(portfolio.sharpe_ratio(), complex)
+
+    def test_nan_returns(self):
+        returns = self.returns.copy()
+        returns.iloc[0, 0] = np.nan
+        portfolio = EqualWeightPortfolio(returns)
+        pd.testing.assert_series_equal(portfolio.mean_returns, returns.mean())
+        pd.testing.assert_frame_equal(portfolio.covariance_matrix, returns.cov())
+        pd.testing.assert_frame_equal(portfolio.accumulated_returns_asset, (returns + 1).cumprod() - 1)
+
     def test_optimal_portfolio(self):
         print("\n===== OptimalPortfolio =====")
         # Test optimal_portfolio
@@ -42,11 +101,44 @@ class TestPortfolio(unittest.TestCase):
         
         # Check if the expected return is close to the target return
         self.assertAlmostEqual(optimal_port.expected_return, self.target_return, places=4)  # type: ignore
+
+        # variance from the attached Cholesky factor matches w^T * cov * w
+        weights = optimal_port.weights
+        self.assertAlmostEqual(optimal_port.variance, weights @ self.returns.cov() @ weights)
         
         print("Optimal Portfolio Weights:\n", optimal_port.weights)
         print("Optimal Portfolio Expected Return:", optimal_port.expected_return)
         print("Optimal Portfolio Variance:", optimal_port.variance)
 
+    def test_optimal_portfolio_with_context(self):
+        context = build_context(self.returns.values)
+        for target_return in (0.01, 0.025, 0.04):
+            optimal_port = optimal_portfolio(self.returns, target_return, context)
+            self.assertAlmostEqual(optimal_port.expected_return, target_return, places=4)  # type: ignore
+
+    def test_optimal_portfolios(self):
+        target_returns = np.array([0.01, 0.025, 0.04])
+        portfolios = optimal_portfolios(self.returns, target_returns)
+        self.assertEqual(len(portfolios), 3)
+        self.assertTrue(all(p.weights.index is self.returns.columns for p in portfolios))
+        for portfolio, target_return in zip(portfolios, target_returns):
+            self.assertAlmostEqual(portfolio.expected_return, target_return, places=4)  # type: ignore
+
+    def test_batch_metrics(self):
+        target_returns = np.array([0.01, 0.025, 0.04])
+        portfolios = optimal_portfolios(self.returns, target_returns)
+        weights = np.vstack([p.weights.to_numpy() for p in portfolios])
+
+        expected_returns, variances = Portfolio.batch_metrics(self.returns.to_numpy(), weights)
+        np.testing.assert_allclose(expected_returns, [p.expected_return for p in portfolios])
+        np.testing.assert_allclose(variances, [p.variance for p in portfolios])
+
+    def test_float32_context(self):
+        context = build_context(self.returns.values, np.float32)
+        self.assertEqual(optimal_portfolio(self.returns, 0.025, context).weights.dtype, np.float64)
+        self.assertEqual(optimal_portfolios(self.returns, np.array([0.025]), context)[0].weights.dtype, np.float64)
+        self.assertEqual(mvp_portfolio(self.returns, context).weights.dtype, np.float64)
+
     def test_mvp_portfolio(self):
         print("\n===== MVP Portfolio =====")
         # Test mvp_portfolio
@@ -4,8 +4,10 @@ Test core
 
 import unittest
 import pandas as pd
-from src.bagel_mean_variance.core import _mu, _cov, _cov_inv, _A, _B, _C, _D, _g, _h
-from src.bagel_mean_variance.core import mvp_weights_using_returns, optimal_weights_using_returns, mvp_weights
+import numpy as np
+from src.bagel_mean_variance.core import _mu, _cov, _cho_factor, _solve_cov, _gh
+from src.bagel_mean_variance.core import mvp_weights_using_returns, optimal_weights_using_returns, mvp_weights, optimal_weights
+from src.bagel_mean_variance.core import build_context, optimal_weights_from_context, optimal_weights_batch, mvp_weights_from_context
 
 
 class TestCore(unittest.TestCase):
@@ -15,25 +17,45 @@ class TestCore(unittest.TestCase):
         self.test_returns = test_returns.to_numpy()
         self.mu = _mu(self.test_returns)
         self.cov = _cov(self.test_returns)
-        self.cov_inv = _cov_inv(self.cov)
-
-    def test_A_B_C_D(self):
-        print("\n===== Test A B C D g h=====")
-
-        A = _A(self.mu, self.cov_inv)
-        B = _B(self.mu, self.cov_inv)
-        C = _C(self.cov_inv)
-        D = _D(A, B, C)
-        g = _g(A, B, D, self.mu, self.cov_inv)
-        h = _h(A, C, D, self.mu, self.cov_inv)
-
-        print(f"A: {A}")
-        print(f"B: {B}")
-        print(f"C: {C}")
-        print(f"D: {D}")
+
+    def test_g_h(self):
+        print("\n===== Test g h =====")
+
+        g, h, cov_inv_ones = _gh(self.mu, self.cov, _cho_factor(self.cov))
+
         print(f"g: {g}")
         print(f"h: {h}")
 
+        # weights sum to 1 and hit the target return for any target
+        self.assertAlmostEqual(g.sum(), 1.0)
+        self.assertAlmostEqual(h.sum(), 0.0)
+        self.assertAlmostEqual(g @ self.mu, 0.0)
+        self.assertAlmostEqual(h @ self.mu, 1.0)
+        np.testing.assert_allclose(cov_inv_ones / cov_inv_ones.sum(), mvp_weights(self.cov))
+
+    def test_singular_cov(self):
+        # a duplicated asset makes the covariance matrix singular
+        returns = np.column_stack([self.test_returns, self.test_returns[:, 0]])
+        mu = _mu(returns)
+        cov = _cov(returns)
+        self.assertIsNone(_cho_factor(cov))
+
+        mvp = mvp_weights(cov)
+        self.assertAlmostEqual(mvp.sum(), 1.0)
+        self.assertAlmostEqual(mvp[0], mvp[-1])
+
+        weights = optimal_weights_using_returns(0.01, returns)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertAlmostEqual(weights @ mu, 0.01)
+
+    def test_cov(self):
+        np.testing.assert_allclose(self.cov, np.cov(self.test_returns, rowvar=False))
+
+    def test_solve_cov(self):
+        ones = np.ones(self.mu.shape[0])
+        expected = np.linalg.inv(self.cov) @ ones
+        np.testing.assert_allclose(_solve_cov(self.cov, ones), expected)
+
     def test_mvp(self):
         print("\n===== Test MVP =====")
         mvp = mvp_weights_using_returns(self.test_returns)
@@ -43,7 +65,7 @@ class TestCore(unittest.TestCase):
         expected_return = mvp.T @ self.mu
 
         print(f"MVP variance: {variance}")
-        C = _C(self.cov_inv)
+        C = np.ones(self.mu.shape[0]) @ _solve_cov(self.cov, np.ones(self.mu.shape[0]))
         print(f"1/C: {1/C}")
         print(f"MVP expected return: {expected_return}")
 
@@ -55,6 +77,53 @@ class TestCore(unittest.TestCase):
         print(f"Optimal Weights variance: {new_variance}")
         print(f"Optimal Weights expected return: {new_expected_return}")
 
+    def test_context(self):
+        context = build_context(self.test_returns)
+        for target_return in (-0.01, 0.0, 0.01, 0.02):
+            np.testing.assert_allclose(
+                optimal_weights_from_context(context, target_return),
+                optimal_weights_using_returns(target_return, self.test_returns),
+            )
+
+    def test_context_mvp(self):
+        context = build_context(self.test_returns)
+        np.testing.assert_allclose(mvp_weights_from_context(context), mvp_weights(self.cov))
+
+        self.assertFalse(context.cov.flags.writeable)
+        self.assertFalse(context.cho[0].flags.writeable)
+        self.assertFalse(context.g.flags.writeable)
+
+    def test_float32(self):
+        context = build_context(self.test_returns, np.float32)
+        self.assertEqual(context.cov.dtype, np.float32)
+        self.assertEqual(context.g.dtype, np.float32)
+
+        mvp = mvp_weights_using_returns(self.test_returns, dtype=np.float32)
+        self.assertEqual(mvp.dtype, np.float64)
+        np.testing.assert_allclose(mvp, mvp_weights_using_returns(self.test_returns), rtol=1e-3, atol=1e-4)
+
+        weights = optimal_weights_using_returns(0.01, self.test_returns, dtype=np.float32)
+        self.assertEqual(weights.dtype, np.float64)
+        np.testing.assert_allclose(weights, optimal_weights_using_returns(0.01, self.test_returns),
+                                   rtol=1e-3, atol=1e-4)
+
+    def test_pandas_and_list_inputs(self):
+        returns = pd.DataFrame(self.test_returns)
+        mu, cov = returns.mean(), returns.cov()
+        np.testing.assert_allclose(mvp_weights(cov), mvp_weights(self.cov))
+        np.testing.assert_allclose(mvp_weights(cov.values.tolist()), mvp_weights(self.cov))
+        np.testing.assert_allclose(optimal_weights(0.01, mu, cov),
+                                   optimal_weights_using_returns(0.01, self.test_returns))
+        np.testing.assert_allclose(optimal_weights_batch(np.array([0.01]), mu, cov)[0],
+                                   optimal_weights_using_returns(0.01, self.test_returns))
+
+    def test_optimal_weights_batch(self):
+        target_returns = np.linspace(-0.01, 0.02, 7)
+        weights = optimal_weights_batch(target_returns, self.mu, self.cov)
+        self.assertEqual(weights.shape, (7, self.mu.shape[0]))
+        np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+        np.testing.assert_allclose(weights @ self.mu, target_returns, atol=1e-12)
+
 
 
 if __name__ == "__main__":